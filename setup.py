@@ -16,6 +16,13 @@ setup(
     packages=find_packages(exclude=['contrib', 'docs', 'tests*', 'test']),
     version='0.1.12',
     install_requires=['requests'],
+    extras_require={
+        'async': ['aiohttp'],
+        'brotli': ['brotli'],
+        'http2': ['httpx[http2]>=0.26'],
+        'ijson': ['ijson>=3.1'],
+        'orjson': ['orjson'],
+    },
     tests_require=['mock'],
     classifiers=[
         'Development Status :: 4 - Beta',
@@ -1,2 +1,3 @@
 from .stackapi import StackAPI
-from .stackapi import StackAPIError
\ No newline at end of file
+from .stackapi import StackAPIError
+from .stackapi import __version__
@@ -0,0 +1,166 @@
+"""Concurrent page retrieval for :meth:`StackAPI.fetch_async <stackapi.StackAPI.fetch_async>`.
+
+This module uses ``async``/``await`` syntax and is only imported on demand,
+so the rest of the package keeps working on Python 2.
+"""
+import asyncio
+import math
+
+try:
+    import aiohttp
+except ImportError:  # Only needed without http2
+    aiohttp = None
+
+from .stackapi import (StackAPIError, ACCEPT_ENCODING, RETRY_STATUSES, USER_AGENT, httpx, _build_result,
+                       _check_response, _decode_json, _httpx_timeout, _retry_delay)
+
+
+class _TransportError(Exception):
+    """Raised by :func:`_send` when no response was received."""
+
+
+def _client_timeout(timeout):
+    if isinstance(timeout, tuple):
+        return aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+    return aiohttp.ClientTimeout(total=timeout)
+
+
+def _open_client(api):
+    """Returns an ``httpx`` client if ``http2`` is set, or an ``aiohttp`` session otherwise."""
+    headers = {'Accept-Encoding': ACCEPT_ENCODING, 'User-Agent': USER_AGENT}
+    if api.http2:
+        # Every request in flight is multiplexed over a single HTTP/2 connection
+        return httpx.AsyncClient(http2=True, headers=headers, proxy=(api.proxy or {}).get('https'),
+                                 timeout=_httpx_timeout(api.timeout),
+                                 limits=httpx.Limits(max_connections=api.max_concurrency))
+    if aiohttp is None:
+        raise ImportError('fetch_async requires aiohttp, or httpx with http2=True')
+    connector = aiohttp.TCPConnector(limit_per_host=api.max_concurrency)
+    return aiohttp.ClientSession(connector=connector, headers=headers, timeout=_client_timeout(api.timeout))
+
+
+async def _send(api, client, url, params):
+    """Sends a ``GET`` request with the client from :func:`_open_client`.
+
+    :rtype: (tuple) The request that was sent, the HTTP status and the body of the response
+    """
+    if api.http2:
+        try:
+            response = await client.get(url, params=params)
+        except httpx.TransportError as e:
+            raise _TransportError(str(e))
+        return response.request, response.status_code, response.content
+
+    # aiohttp only accepts strings and numbers, so convert values the way requests does
+    params = dict((k, v if isinstance(v, str) else str(v)) for k, v in params.items())
+    try:
+        async with client.get(url, params=params, proxy=(api.proxy or {}).get('https')) as response:
+            return response.request_info, response.status, await response.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise _TransportError(str(e))
+
+
+async def _get_page(api, client, semaphore, url, params):
+    """Requests a single page, retrying transient failures like :meth:`StackAPI._request`.
+
+    Pages are requested concurrently, so the request of each page is kept
+    here for its errors rather than in ``api``.
+
+    :rtype: (tuple) The request that was sent and the decoded response
+    """
+    attempt = 0
+    request = None
+    async with semaphore:
+        while True:
+            delay = api._backoff_remaining()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            retry = attempt < api.max_retries
+            try:
+                request, status, body = await _send(api, client, url, params)
+            except _TransportError as e:
+                if not retry:
+                    raise StackAPIError(url if request is None else str(request.url), str(e), str(e), str(e))
+            else:
+                if status not in RETRY_STATUSES or not retry:
+                    try:
+                        response = _decode_json(body)
+                    except ValueError as e:
+                        raise StackAPIError(str(request.url), str(e), str(e), str(e))
+                    response = _check_response(request, response, retry)
+                    if response is not None:
+                        break
+            await asyncio.sleep(_retry_delay(attempt))
+            attempt += 1
+
+    api._record_backoff(response)
+    return request, response
+
+
+async def _fetch_pages(api, client, semaphore, base_url, params, page):
+    """Requests the pages of a single end point.
+
+    :rtype: (list) The ``(request, response)`` of every page, in page order
+    """
+    last_page = page + api.max_pages - 1
+    if last_page > page and params['filter'] != 'total':
+        # The built-in total filter returns nothing but the number of results,
+        # so it is cheap to request the page count alongside the first page
+        first, (_, count) = await asyncio.gather(
+            _get_page(api, client, semaphore, base_url, params),
+            _get_page(api, client, semaphore, base_url, dict(params, filter='total')))
+    else:
+        first = await _get_page(api, client, semaphore, base_url, params)
+        count = first[1]
+    pages = [first]
+
+    if first[1].get('has_more') and 'total' in count:
+        # The page count is known up front, so request the rest all at once
+        last_page = min(last_page, int(math.ceil(count['total'] / float(params['pagesize']))))
+        pages.extend(await asyncio.gather(*[
+            _get_page(api, client, semaphore, base_url, dict(params, page=p))
+            for p in range(page + 1, last_page + 1)
+        ]))
+    else:
+        while pages[-1][1].get('has_more') and params['page'] < last_page:
+            params['page'] += 1
+            pages.append(await _get_page(api, client, semaphore, base_url, params))
+
+    return pages
+
+
+async def fetch_async(api, endpoint=None, page=1, key=None, filter='default', **kwargs):
+    if not endpoint:
+        raise ValueError('No end point provided.')
+
+    # This may download the list of sites, so keep it off the event loop
+    await asyncio.get_running_loop().run_in_executor(None, api._ensure_site_resolved)
+    endpoints, params = api._prepare_fetch(endpoint, page, filter, kwargs)
+    cache_key, result = api._cached_result(endpoints, key, params)
+    if result is not None:
+        return result
+
+    semaphore = asyncio.Semaphore(api.max_concurrency)
+    async with _open_client(api) as client:
+        # Every group of ids is paginated independently, so they run concurrently too
+        results = await asyncio.gather(*[
+            _fetch_pages(api, client, semaphore, "{}{}/".format(api._base_url, endpoint), dict(params), page)
+            for endpoint in endpoints
+        ])
+
+    # The last page is the previous call, whichever page finished last
+    api._last_request, last = results[-1][-1]
+    backoff = max(int(response.get('backoff', 0)) for pages in results for _, response in pages)
+    total = sum(pages[0][1].get('total', 0) for pages in results)
+    last_page = page + len(results[-1]) - 1
+    has_more = any(pages[-1][1].get('has_more') for pages in results)
+    items = []
+    for pages in results:
+        for _, response in pages:
+            data = response[key] if key else response
+            if 'items' in data:
+                items.extend(data['items'])
+    del results
+
+    result = _build_result(items, last, last_page, backoff, total, has_more)
+    return api._cache_result(cache_key, result)
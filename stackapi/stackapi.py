@@ -1,10 +1,178 @@
 import requests
-from itertools import chain
-from time import sleep
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from collections import OrderedDict
+from contextlib import closing
+from time import sleep, time
 import datetime
 import calendar
+import copy
+import json
+import os
+import tempfile
+import threading
 import requests.compat
 
+try:
+    from time import monotonic
+except ImportError:  # Python 2
+    from time import time as monotonic
+
+try:
+    import brotli  # noqa: F401 (lets urllib3 decode brotli responses)
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+try:
+    from orjson import loads as _loads
+except ImportError:
+    def _loads(body):
+        return json.loads(body.decode('utf-8'))
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+__version__ = '0.1.12'
+USER_AGENT = 'stackapi/{}'.format(__version__)
+
+# HTTP statuses that indicate a transient failure worth retrying
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+# API error_ids (internal_error, throttle_violation, temporarily_unavailable)
+# that are worth retrying
+RETRY_ERRORS = frozenset([500, 502, 503])
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 60
+
+# The API accepts at most 100 semicolon delimited ids per request
+MAX_IDS = 100
+
+# The number of results kept by the in-process cache of fetch results
+RESULT_CACHE_SIZE = 128
+
+# The list of sites changes rarely, so it is only refreshed once a week
+SITES_CACHE_TTL = 7 * 24 * 60 * 60
+
+_replace = getattr(os, 'replace', os.rename)  # os.replace is Python 3.3+
+
+
+def _default_cache_dir():
+    """Returns the per-user directory StackAPI caches the list of sites in."""
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'stackapi')
+
+
+UTF8_BOM = b'\xef\xbb\xbf'
+
+
+def _decode_json(body):
+    """Decodes a raw response body, which may start with a UTF-8 byte order mark.
+
+    Raises ``ValueError`` if the body isn't valid JSON.
+    """
+    if body[:3] == UTF8_BOM:
+        body = body[3:]
+    return _loads(body)
+
+
+class _BOMSkippingReader(object):
+    """Wraps a file-like response body and drops a leading UTF-8 byte order mark."""
+
+    def __init__(self, raw):
+        self._raw = raw
+        head = raw.read(len(UTF8_BOM))
+        self._head = b'' if head == UTF8_BOM else head
+
+    def read(self, size=None):
+        if size is None or size < 0:
+            head, self._head = self._head, b''
+            return head + self._raw.read()
+        head, self._head = self._head[:size], self._head[size:]
+        if len(head) == size:
+            return head
+        return head + self._raw.read(size - len(head))
+
+
+def _decode_stream(raw):
+    """Decodes a response body while it is being downloaded, without holding
+    the raw bytes or text of the whole body in memory. The body may start
+    with a UTF-8 byte order mark.
+
+    Raises ``ValueError`` if the body isn't valid JSON.
+    """
+    raw.decode_content = True
+    try:
+        return dict(ijson.kvitems(_BOMSkippingReader(raw), '', use_float=True))
+    except ijson.JSONError as e:
+        raise ValueError(str(e))
+
+
+def _check_response(request, response, retry):
+    """Raises ``StackAPIError`` if a decoded response is an API error.
+
+    :param request: (request) The request that was sent. Its URL is only built
+        for the error.
+    :param response: (dictionary) The decoded response
+    :param retry: (bool) Whether a transient API error may be retried
+    :rtype: (dictionary) The response, or ``None`` if it is a transient API error
+        and ``retry`` is set
+    """
+    error = response.get("error_id")
+    if error is None:
+        return response  # This means there is no error
+    if retry and error in RETRY_ERRORS:
+        return None
+    raise StackAPIError(str(request.url), error, response["error_name"], response["error_message"])
+
+
+def _httpx_timeout(timeout):
+    """Converts a ``timeout`` in the format accepted by ``requests`` to an ``httpx.Timeout``."""
+    if isinstance(timeout, tuple):
+        return httpx.Timeout(timeout[1], connect=timeout[0])
+    return httpx.Timeout(timeout)
+
+
+def _retry_delay(attempt):
+    """Returns the exponential backoff delay, in seconds, before retry number ``attempt``."""
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)
+
+
+class _TTLCache(object):
+    """A least recently used cache whose entries expire ``ttl`` seconds after
+    they are stored."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key):
+        """Returns the value stored for ``key``, or ``None`` if it is missing or expired."""
+        try:
+            expires, value = self._data.pop(key)
+        except KeyError:
+            return None
+        if expires < monotonic():
+            return None
+        self._data[key] = (expires, value)  # Now the most recently used
+        return value
+
+    def set(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = (monotonic() + self.ttl, value)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
 
 class StackAPIError(Exception):
     """
@@ -26,7 +194,33 @@ class StackAPIError(Exception):
         self.message = message
 
 
+def _build_result(items, last, page, backoff, total, has_more):
+    """Builds the result dictionary returned by :meth:`StackAPI.fetch`.
+
+    :param items: (list) The ``items`` of every page, in page order
+    :param last: (dictionary) The last decoded response, whole even if ``key`` was passed
+    :param page: (int) The last page that was requested
+    :param backoff: (int) The last ``backoff`` value returned by the API
+    :param total: (int) The ``total`` value returned by the API
+    :param has_more: (bool) Whether any group of ``ids`` stopped at ``max_pages``
+        with results left
+    :rtype: (dictionary) The wrapper data of the last page with the ``items``
+        of every page
+    """
+    return {'backoff': backoff,
+            'has_more': has_more,
+            'page': page,
+            'quota_max': last.get('quota_max', -1),
+            'quota_remaining': last.get('quota_remaining', -1),
+            'total': total,
+            'items': items}
+
+
 class StackAPI(object):
+    # {version: ({api_site_parameter: name}, time of download or None)}, shared by every instance
+    _SITES_CACHE = {}
+    _SITES_LOCK = threading.RLock()
+
     def __init__(self, name=None, version="2.2", **kwargs):
         """
         The object used to interact with the Stack Exchange API
@@ -34,7 +228,8 @@ class StackAPI(object):
         :param name: (string) **(Required)** A valid ``api_site_parameter``
             (available from http://api.stackexchange.com/docs/sites) which will
             be used to connect to a particular site on the Stack Exchange
-            Network.
+            Network. It is checked against the list of sites on the first call to
+            the API, which raises a ``ValueError`` if the site doesn't exist.
         :param version: (float) **(Required)** The version of the API you are connecting to.
             The default of ``2.2`` is the current version
         :param proxy: (dict) (optional) A dictionary of http and https proxy locations
@@ -52,84 +247,311 @@ class StackAPI(object):
         :param key: (string) (optional) An API key
         :param access_token: (string) (optional) An access token associated with an application and
             a user, to grant more permissions (such as write access)
+        :param max_concurrency: (int) (optional) The maximum number of requests :meth:`fetch_async`
+            keeps in flight at once (Default: ``10``)
+        :param max_retries: (int) (optional) How many times a request is retried after a connection
+            error, a ``429``/``5xx`` response or a transient API error (such as a
+            ``throttle_violation``) before giving up (Default: ``5``)
+        :param timeout: (float or tuple) (optional) The ``(connect, read)`` timeout, in seconds, passed
+            to every HTTP call (Default: ``(5, 30)``)
+        :param stream_json: (bool) (optional) Decode responses with `ijson <https://pypi.org/project/ijson/>`__
+            while they download, instead of after. This lowers the memory used by very large pages,
+            such as those returned by filters that include post bodies. Requires ``ijson``.
+            (Default: ``False``)
+        :param http2: (bool) (optional) Send requests over HTTP/2 with `httpx <https://www.python-httpx.org/>`__
+            instead of ``requests``. The concurrent requests of :meth:`fetch_async` then share a
+            single connection. Requires ``httpx`` and can't be combined with ``stream_json``.
+            (Default: ``False``)
+        :param cache_ttl: (int) (optional) Keep the results of :meth:`fetch` and :meth:`fetch_async`
+            in memory for this many seconds, and return them again when the same call is repeated
+            instead of calling the API. Results that stopped at ``max_pages`` with ``has_more``
+            still set are not kept. By default, results are not kept.
+        :param cache_dir: (string) (optional) The directory the list of Stack Exchange sites is cached
+            in for a week, so that it isn't downloaded every time the class is created. Pass ``None``
+            to disable the cache. (Default: the user's cache directory)
         """
         if not name:
             raise ValueError('No Site Name provided')
+        if kwargs.get('stream_json') and ijson is None:
+            raise ValueError('stream_json requires the ijson package')
+        if kwargs.get('http2') and httpx is None:
+            raise ValueError('http2 requires the httpx package')
+        if kwargs.get('http2') and kwargs.get('stream_json'):
+            raise ValueError('http2 and stream_json can not be combined')
 
         self.proxy = kwargs.get('proxy', None)
         self.max_pages = kwargs.get('max_pages', 5)
         self.page_size = kwargs.get('page_size', 100)
         self.key = kwargs.get('key', None)
         self.access_token = kwargs.get('access_token', None)
+        self.max_concurrency = kwargs.get('max_concurrency', 10)
+        self.max_retries = kwargs.get('max_retries', 5)
+        self.timeout = kwargs.get('timeout', (5, 30))
+        self.stream_json = kwargs.get('stream_json', False)
+        self.http2 = kwargs.get('http2', False)
+        self.cache_ttl = kwargs.get('cache_ttl', None)
+        self.cache_dir = kwargs.get('cache_dir', _default_cache_dir())
         self._endpoint = None
-        self._api_key = None
+        self._site = name
+        self._site_resolved = False
+        self._resolving_site = False
+        self._api_key = name
         self._name = None
         self._version = version
-        self._previous_call = None
+        self._last_request = None
+        self._next_allowed_ts = 0.0
+        self._cache = _TTLCache(RESULT_CACHE_SIZE, self.cache_ttl) if self.cache_ttl else None
+
+        # A single session keeps the connection to the API alive between pages
+        # instead of paying for a new TCP/TLS handshake on every request
+        self._session = requests.Session()
+        self._session.proxies = self.proxy or {}
+        self._session.headers.update({'Accept-Encoding': ACCEPT_ENCODING, 'User-Agent': USER_AGENT})
+        retries = Retry(total=self.max_retries, backoff_factor=RETRY_BASE_DELAY,
+                        status_forcelist=RETRY_STATUSES, respect_retry_after_header=True,
+                        raise_on_status=False)
+        self._session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=self.max_pages,
+                                                    max_retries=retries))
+
+        self._client = None
+        if self.http2:
+            self._client = httpx.Client(http2=True, headers={'User-Agent': USER_AGENT},
+                                        proxy=(self.proxy or {}).get('https'), timeout=_httpx_timeout(self.timeout))
 
         self._base_url = 'https://api.stackexchange.com/{}/'.format(version)
-        sites = self.fetch('sites', filter='!*L1*AY-85YllAr2)', pagesize=1000)
-        for s in sites['items']:
-            if name == s['api_site_parameter']:
-                self._name = s['name']
-                self._api_key = s['api_site_parameter']
-                break
 
-        if not self._name:
-            raise ValueError('Invalid Site Name provided')
+    def _sites_cache_path(self):
+        return os.path.join(self.cache_dir, 'sites-{}.json'.format(self._version))
+
+    def _load_sites_cache(self):
+        """Returns the cached ``{api_site_parameter: name}`` mapping of sites, or
+        ``None`` if it is missing or stale."""
+        if not self.cache_dir:
+            return None
+        path = self._sites_cache_path()
+        try:
+            if time() - os.path.getmtime(path) > SITES_CACHE_TTL:
+                return None
+            with open(path) as cache_file:
+                sites = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return None
+        return sites if isinstance(sites, dict) else None
+
+    def _save_sites_cache(self, sites):
+        """Writes the mapping of sites to the cache. The file is replaced atomically,
+        so concurrent processes never read a partial file."""
+        if not self.cache_dir:
+            return
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as cache_file:
+                json.dump(sites, cache_file)
+            _replace(tmp_path, self._sites_cache_path())
+        except (IOError, OSError):
+            pass  # The cache is only an optimization
+
+    def _fetch_sites(self):
+        """Downloads the list of sites as an ``{api_site_parameter: name}`` mapping."""
+        api_key, self._api_key = self._api_key, None  # The sites end point doesn't accept a site
+        try:
+            sites = self.fetch('sites', filter='!*L1*AY-85YllAr2)', pagesize=1000)
+        finally:
+            self._api_key = api_key
+        sites = dict((s['api_site_parameter'], s['name']) for s in sites['items'])
+        self._save_sites_cache(sites)
+        return sites
+
+    def _ensure_site_resolved(self):
+        """Looks up the name of the site passed to the constructor, the first time
+        it is needed.
+
+        The sites are kept in memory for every instance, and on disk for a week.
+        They are only downloaded when neither has them, or when neither
+        contains the site, in case it is new. A list downloaded by this
+        process isn't downloaded again for a week, even for an unknown site.
+        """
+        if self._site_resolved:
+            return
+        with StackAPI._SITES_LOCK:
+            # Another thread may have resolved the site while this one waited.
+            # The lock is reentrant, so the fetch of the sites below comes back
+            # through here on the same thread, and must not resolve again.
+            if self._site_resolved or self._resolving_site:
+                return
+            self._resolving_site = True
+            try:
+                sites, downloaded = StackAPI._SITES_CACHE.get(self._version, (None, None))
+                fresh = downloaded is not None and monotonic() - downloaded < SITES_CACHE_TTL
+                if sites is None or (self._site not in sites and not fresh):
+                    sites, downloaded = self._load_sites_cache(), None
+                    if sites is None or self._site not in sites:
+                        sites, downloaded = self._fetch_sites(), monotonic()
+                    StackAPI._SITES_CACHE[self._version] = (sites, downloaded)
+            finally:
+                self._resolving_site = False
+
+            name = sites.get(self._site)
+            if not name:
+                raise ValueError('Invalid Site Name provided')
+            self._name = name
+            self._site_resolved = True
+
+    @property
+    def previous_call(self):
+        """The URL of the last call made to the API, or ``None``. It is only built
+        from the last request when it is read."""
+        if self._last_request is None:
+            return None
+        return str(self._last_request.url)
+
+    def close(self):
+        """Closes the connections kept open to the API. The object can't be used
+        afterwards. It can also be used as a context manager, which calls this
+        on exit:
+
+            .. code-block:: python
+
+                with StackAPI('stackoverflow', http2=True) as SITE:
+                    questions = SITE.fetch('questions')
+        """
+        if self._client is not None:
+            self._client.close()
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
     def __repr__(self):
         return "<{}> v:<{}> endpoint: {}  Last URL: {}".format(self._name,
                                                                self._version,
                                                                self._endpoint,
-                                                               self._previous_call)
+                                                               self.previous_call)
 
-    def fetch(self, endpoint=None, page=1, key=None, filter='default', **kwargs):
-        """Returns the results of an API call.
+    def _backoff_remaining(self):
+        """Returns how many seconds are left of the last ``backoff`` requested by the API."""
+        return self._next_allowed_ts - monotonic()
 
-        This is the main work horse of the class. It builds the API query
-        string and sends the request to Stack Exchange. If there are multiple
-        pages of results, and we've configured `max_pages` to be greater than
-        1, it will automatically paginate through the results and return a
-        single object.
+    def _record_backoff(self, response):
+        """Remembers the ``backoff`` of a decoded response, so that the next
+        request to the API, from any method, waits for it to pass."""
+        if 'backoff' in response:
+            self._next_allowed_ts = monotonic() + int(response['backoff'])
 
-        Returned data will appear in the `items` key of the resulting
-        dictionary.
-
-        :param endpoint: (string) The API end point being called. Available endpoints are listed on
-            the official API documentation: http://api.stackexchange.com/docs
+    def _send(self, method, url, retry, **kwargs):
+        """Sends a single request, with the HTTP/2 client if ``http2`` is set and
+        the shared session otherwise.
 
-            This can be as simple as ``fetch('answers')``, to call the answers
-            end point
+        The session retries connection errors and ``429``/``5xx`` responses
+        itself. The HTTP/2 client doesn't, so for it ``None`` is returned
+        instead if ``retry`` is set.
 
-            If calling an end point that takes additional parameter, such as `id`s
-            pass the ids as a list to the `ids` key:
+        :rtype: (response) The ``requests`` or ``httpx`` response
+        """
+        if self._client is None:
+            try:
+                return self._session.request(method, url, timeout=self.timeout, stream=self.stream_json, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                raise StackAPIError(self.previous_call, str(e), str(e), str(e))
 
-                .. code-block:: python
+        try:
+            response = self._client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            if retry:
+                return None
+            raise StackAPIError(self.previous_call, str(e), str(e), str(e))
+        if retry and response.status_code in RETRY_STATUSES:
+            return None
+        return response
+
+    def _request(self, method, url, **kwargs):
+        """Sends a request and decodes the response.
+
+        Any ``backoff`` the API asked for is waited out first. ``GET``
+        requests failing with a connection error, a ``429``/``5xx`` response
+        or a transient API error, such as a ``throttle_violation``, are
+        retried up to ``max_retries`` times with an exponential delay.
+
+        :rtype: (dictionary) The decoded response
+        """
+        attempt = 0
+        while True:
+            delay = self._backoff_remaining()
+            if delay > 0:
+                sleep(delay)
+            retry = method == 'GET' and attempt < self.max_retries
+            response = self._send(method, url, retry, **kwargs)
+            if response is not None:
+                self._last_request = response.request
+                # A 429/5xx response has used up the retries of the transport
+                # already, so its error_id is not retried again here
+                if response.status_code in RETRY_STATUSES:
+                    retry = False
+                try:
+                    if self.stream_json:
+                        with closing(response):
+                            response = _decode_stream(response.raw)
+                    else:
+                        response = _decode_json(response.content)
+                except ValueError as e:
+                    raise StackAPIError(self.previous_call, str(e), str(e), str(e))
+
+                response = _check_response(self._last_request, response, retry)
+                if response is not None:
+                    self._record_backoff(response)
+                    return response
+            sleep(_retry_delay(attempt))
+            attempt += 1
+
+    def _cached_result(self, endpoints, key, params):
+        """Looks up the result of an earlier identical call in the result cache.
+
+        :rtype: (tuple) The cache key, or ``None`` if the call can't be cached,
+            and a copy of the cached result, or ``None`` if there isn't one
+        """
+        if self._cache is None:
+            return None, None
+        cache_key = (tuple(endpoints), key, tuple(sorted(params.items())))
+        try:
+            result = self._cache.get(cache_key)
+        except TypeError:
+            return None, None  # A parameter, such as a list, can't be hashed
+        if result is not None:
+            result = copy.deepcopy(result)
+        return cache_key, result
+
+    def _cache_result(self, cache_key, result):
+        """Stores a complete result in the result cache. Results with ``has_more``
+        set, which is set if any group of ``ids`` stopped at ``max_pages``, are
+        truncated and aren't stored.
+
+        :rtype: (dictionary) A deep copy of ``result``, so that changes made by
+            the caller, even to the items, don't alter the cache
+        """
+        if cache_key is None or result['has_more']:
+            return result
+        self._cache.set(cache_key, result)
+        return copy.deepcopy(result)
 
-                    fetch('answers/{}', ids=[1,2,3])
+    def _prepare_fetch(self, endpoint, page, filter, kwargs):
+        """Builds the end point paths and query parameters shared by
+        :meth:`fetch` and :meth:`fetch_async`.
 
-            This will attempt to retrieve the answers for the three listed ids.
+        The API accepts at most 100 ``ids`` per request, so longer lists are
+        split across several end point paths.
 
-            If no end point is passed, a ``ValueError`` will be raised
-        :param page: (int) The page in the results to start at. By default, it will start on
-            the first page and automatically paginate until the result set
-            reached ``max_pages``.
-        :param key: (string) The site you are issuing queries to.
-        :param filter: (string) The filter to utilize when calling an endpoint. Different filters
-            will return different keys. The default is ``default`` and this will
-            still vary depending on what the API returns as default for a
-            particular endpoint
-        :param kwargs: Parameters accepted by individual endpoints. These parameters
-            **must** be named the same as described in the endpoint documentation
-        :rtype: (dictionary) A dictionary containing wrapper data regarding the API call
-            and the results of the call in the `items` key. If multiple
-            pages were received, all of the results will appear in the
-            ``items`` tag.
+        :rtype: (tuple) The list of end points with the ``ids`` substituted in
+            and the dictionary of query parameters for the first page
         """
         if not endpoint:
             raise ValueError('No end point provided.')
 
+        self._ensure_site_resolved()
         self._endpoint = endpoint
 
         params = {
@@ -143,6 +565,8 @@ class StackAPI(object):
         if self.access_token:
             params['access_token'] = self.access_token
 
+        ids = kwargs.pop('ids', None)
+
         # This block will replace {ids} placeholds in end points
         # converting .fetch('badges/{ids}', ids=[222, 1306, 99999]) to
         #   badges/222;1306;99999
@@ -161,78 +585,125 @@ class StackAPI(object):
         # This would occur if the developer passed `badges` instead of `badges/{ids}` to `fetch`
         # If this is the case, then convert to a string and assume this goes at the end of the endpoint
 
-        if 'ids' in kwargs:
-            ids = ';'.join(str(x) for x in kwargs['ids'])
-            kwargs.pop('ids', None)
-            endpoint += "/{}".format(ids)
+        endpoints = [endpoint]
+        if ids is not None:
+            ids = [str(x) for x in ids]
+            chunks = [ids[i:i + MAX_IDS] for i in range(0, len(ids), MAX_IDS)] or [[]]
+            if "{ids}" in endpoint:
+                endpoints = [endpoint.replace("{ids}", ';'.join([requests.compat.quote_plus(x) for x in chunk]))
+                             for chunk in chunks]
+            else:
+                endpoints = ["{}/{}".format(endpoint, ';'.join(chunk)) for chunk in chunks]
 
         params.update(kwargs)
         if self._api_key:
             params['site'] = self._api_key
 
-        data = []
-        run_cnt = 1
+        return endpoints, params
+
+    def fetch(self, endpoint=None, page=1, key=None, filter='default', **kwargs):
+        """Returns the results of an API call.
+
+        This is the main work horse of the class. It builds the API query
+        string and sends the request to Stack Exchange. If there are multiple
+        pages of results, and we've configured `max_pages` to be greater than
+        1, it will automatically paginate through the results and return a
+        single object.
+
+        Returned data will appear in the `items` key of the resulting
+        dictionary.
+
+        :param endpoint: (string) The API end point being called. Available endpoints are listed on
+            the official API documentation: http://api.stackexchange.com/docs
+
+            This can be as simple as ``fetch('answers')``, to call the answers
+            end point
+
+            If calling an end point that takes additional parameter, such as `id`s
+            pass the ids as a list to the `ids` key:
+
+                .. code-block:: python
+
+                    fetch('answers/{}', ids=[1,2,3])
+
+            This will attempt to retrieve the answers for the three listed ids.
+
+            The API accepts at most 100 ids per call. Longer lists are split into
+            groups of 100, each of which is paginated separately.
+
+            If no end point is passed, a ``ValueError`` will be raised
+        :param page: (int) The page in the results to start at. By default, it will start on
+            the first page and automatically paginate until the result set
+            reached ``max_pages``.
+        :param key: (string) The site you are issuing queries to.
+        :param filter: (string) The filter to utilize when calling an endpoint. Different filters
+            will return different keys. The default is ``default`` and this will
+            still vary depending on what the API returns as default for a
+            particular endpoint
+        :param kwargs: Parameters accepted by individual endpoints. These parameters
+            **must** be named the same as described in the endpoint documentation
+        :rtype: (dictionary) A dictionary containing wrapper data regarding the API call
+            and the results of the call in the `items` key. If multiple
+            pages were received, all of the results will appear in the
+            ``items`` tag.
+        """
+        endpoints, params = self._prepare_fetch(endpoint, page, filter, kwargs)
+        cache_key, result = self._cached_result(endpoints, key, params)
+        if result is not None:
+            return result
+
+        items = []
+        last = None
         backoff = 0
         total = 0
-        while run_cnt <= self.max_pages:
-            run_cnt += 1
-
+        has_more = False
+        for endpoint in endpoints:
             base_url = "{}{}/".format(self._base_url, endpoint)
+            endpoint_total = 0
+            for page_number in range(page, page + self.max_pages):
+                params['page'] = page_number
+                response = last = self._request('GET', base_url, params=params)
+                data = response[key] if key else response
+                if 'items' in data:
+                    items.extend(data['items'])
+
+                # The backoff is waited out by _request before the next request,
+                # rather than here, so the last page does not block on it
+                backoff = int(response.get('backoff', 0))
+                endpoint_total = response.get('total', 0)
+                if not response.get('has_more'):
+                    break
+            total += endpoint_total
+            # A group that stopped at max_pages truncates the result, even if
+            # the groups after it were complete
+            has_more = has_more or bool(response.get('has_more'))
+
+        result = _build_result(items, last, params['page'], backoff, total, has_more)
+        return self._cache_result(cache_key, result)
+
+    def fetch_async(self, endpoint=None, page=1, key=None, filter='default', **kwargs):
+        """Returns the results of an API call, requesting pages concurrently.
+
+        This accepts the same arguments and returns the same dictionary as
+        :meth:`fetch`, but is a coroutine and must be awaited:
 
-            try:
-                response = requests.get(base_url, params=params, proxies=self.proxy)
-            except requests.exceptions.ConnectionError as e:
-                raise StackAPIError(self._previous_call, str(e), str(e), str(e))
+            .. code-block:: python
 
-            self._previous_call = response.url
-            try:
-                response.encoding = 'utf-8-sig'
-                response = response.json()
-            except ValueError as e:
-                raise StackAPIError(self._previous_call, str(e), str(e), str(e))
+                questions = await SITE.fetch_async('questions', tagged='python')
 
-            try:
-                error = response["error_id"]
-                code = response["error_name"]
-                message = response["error_message"]
-                raise StackAPIError(self._previous_call, error, code, message)
-            except KeyError:
-                pass  # This means there is no error
-
-            if key:
-                data.append(response[key])
-            else:
-                data.append(response)
-
-            if len(data) < 1:
-                break
-
-            backoff = 0
-            total = 0
-            page = 1
-            if 'backoff' in response:
-                backoff = int(response['backoff'])
-                sleep(backoff+1)        # Sleep an extra second to ensure no timing issues
-            if 'total' in response:
-                total = response['total']
-            if 'has_more' in response and response['has_more'] and run_cnt <= self.max_pages:
-                params["page"] += 1
-            else:
-                break
-
-        r = []
-        for d in data:
-            if 'items' in d:
-                r.extend(d['items'])
-        result = {'backoff': backoff,
-                  'has_more': False if 'has_more' not in data[-1] else data[-1]['has_more'],
-                  'page': params['page'],
-                  'quota_max': -1 if 'quota_max' not in data[-1] else data[-1]['quota_max'],
-                  'quota_remaining': -1 if 'quota_remaining' not in data[-1] else data[-1]['quota_max'],
-                  'total': total,
-                  'items': list(chain(r))}
+        The first page is requested together with the number of results, using
+        the built-in ``total`` filter. Once both have arrived, the number of
+        remaining pages is known and they are all requested at once, with at
+        most ``max_concurrency`` requests in flight. If the end point doesn't
+        return a ``total``, pages are requested one after another, just like
+        :meth:`fetch`.
 
-        return result
+        This requires Python 3.7+ and `aiohttp <https://docs.aiohttp.org/>`__,
+        which can be installed with ``pip install StackAPI[async]``. If ``http2``
+        is set, ``httpx`` is used instead.
+        """
+        from ._async import fetch_async
+        return fetch_async(self, endpoint, page=page, key=key, filter=filter, **kwargs)
 
     def send_data(self, endpoint=None, page=1, key=None, filter='default', **kwargs):
         """Sends data to the API.
@@ -280,6 +751,7 @@ class StackAPI(object):
         if not endpoint:
             raise ValueError('No end point provided.')
 
+        self._ensure_site_resolved()
         self._endpoint = endpoint
 
         params = {
@@ -303,29 +775,12 @@ class StackAPI(object):
         if self._api_key:
             params['site'] = self._api_key
 
-        data = []
-
         base_url = "{}{}/".format(self._base_url, endpoint)
-        response = requests.post(base_url, data=params, proxies=self.proxy)
-        self._previous_call = response.url
-        response = response.json()
-
-        try:
-            error = response["error_id"]
-            code = response["error_name"]
-            message = response["error_message"]
-            raise StackAPIError(self._previous_call, error, code, message)
-        except KeyError:
-            pass  # This means there is no error
-
-        data.append(response)
-        r = []
-        for d in data:
-            r.extend(d['items'])
-        result = {'has_more': data[-1]['has_more'],
+        response = self._request('POST', base_url, data=params)
+        result = {'has_more': response['has_more'],
                   'page': params['page'],
-                  'quota_max': data[-1]['quota_max'],
-                  'quota_remaining': data[-1]['quota_remaining'],
-                  'items': list(chain(r))}
+                  'quota_max': response['quota_max'],
+                  'quota_remaining': response['quota_remaining'],
+                  'items': response['items']}
 
         return result
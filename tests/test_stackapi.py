@@ -1,9 +1,17 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import io
 import json
 import os.path
+import shutil
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import mock
+import requests
 from mock import patch
 from stackapi import StackAPI
 from stackapi import StackAPIError
@@ -25,7 +33,54 @@ def fake_users(self, endpoint=None, page=1, key=None, filter='default', **kwargs
     return j_data
 
 
+def fake_site(**kwargs):
+    with patch('stackapi.StackAPI.fetch', fake_stackoverflow_exists):
+        site = StackAPI('stackoverflow', **kwargs)
+        site._ensure_site_resolved()
+    return site
+
+
+def fake_response(payload, status_code=200):
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = 'https://api.stackexchange.com/2.2/fake/'
+    response._content = json.dumps(payload).encode('utf-8')
+    return response
+
+
+def serve(test, handler):
+    """Serves ``handler`` on a local port until the end of ``test`` and
+    returns the base URL of the API on it"""
+    try:
+        from http.server import HTTPServer
+        from socketserver import ThreadingMixIn
+    except ImportError:
+        from BaseHTTPServer import HTTPServer
+        from SocketServer import ThreadingMixIn
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    test.addCleanup(server.server_close)
+    test.addCleanup(server.shutdown)
+    return 'http://127.0.0.1:{}/2.2/'.format(server.server_address[1])
+
+
 class Test_StackAPI(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        patcher = patch('stackapi.stackapi._default_cache_dir', return_value=self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        sites_patcher = patch.dict(StackAPI._SITES_CACHE, clear=True)
+        sites_patcher.start()
+        self.addCleanup(sites_patcher.stop)
+
     def test_no_site_provided(self):
         """Testing that it raises the correct error when no site is provided"""
         with self.assertRaises(ValueError) as cm:
@@ -43,24 +98,381 @@ class Test_StackAPI(unittest.TestCase):
     @patch('stackapi.StackAPI.fetch', fake_stackoverflow_exists)
     def test_stackoverflow_exists(self):
         """Simply testing the object is created correctly"""
-        self.assertEqual(StackAPI('stackoverflow')._name, "Stack Overflow")
+        site = StackAPI('stackoverflow')
+        site._ensure_site_resolved()
+        self.assertEqual(site._name, "Stack Overflow")
 
     @patch('stackapi.StackAPI.fetch', fake_stackoverflow_exists)
     def test_asdfghjkl_not_exist(self):
         """Testing that it raises the correct error on unknown site"""
         with self.assertRaises(ValueError) as cm:
             site = StackAPI('asdfghjkl')
+            site._ensure_site_resolved()
             self.assertEqual('Invalid Site Name provided', str(cm.exception))
 
+    @unittest.skipIf(sys.version_info < (3, 7), "fetch_async requires Python 3.7+ to test")
+    def test_fetch_async_no_endpoint_provided(self):
+        """Testing that fetch_async raises the correct error before calling the API
+        when no endpoint is provided"""
+        import asyncio
+        site = StackAPI('stackoverflow')
+        with patch('stackapi.StackAPI.fetch', side_effect=fake_stackoverflow_exists, autospec=True) as mock_fetch:
+            with self.assertRaises(ValueError) as cm:
+                asyncio.run(site.fetch_async())
+        self.assertEqual('No end point provided.', str(cm.exception))
+        self.assertEqual(mock_fetch.call_count, 0)
+
+    def test_site_resolved_lazily(self):
+        """Testing that creating the object doesn't call the API"""
+        with patch('stackapi.StackAPI.fetch', side_effect=fake_stackoverflow_exists, autospec=True) as mock_fetch:
+            site = StackAPI('stackoverflow')
+        self.assertEqual(mock_fetch.call_count, 0)
+        self.assertEqual(site._api_key, 'stackoverflow')
+
+    def test_sites_cached(self):
+        """Testing that the list of sites is only fetched once, in memory and on disk"""
+        with patch('stackapi.StackAPI.fetch', side_effect=fake_stackoverflow_exists, autospec=True) as mock_fetch:
+            StackAPI('stackoverflow')._ensure_site_resolved()
+            StackAPI('stackoverflow')._ensure_site_resolved()
+            StackAPI._SITES_CACHE.clear()
+            site = StackAPI('stackoverflow')
+            site._ensure_site_resolved()
+        self.assertEqual(mock_fetch.call_count, 1)
+        self.assertEqual(site._name, "Stack Overflow")
+
+    def test_unknown_site_downloaded_once(self):
+        """Testing that an unknown site doesn't download the list of sites
+        again on every call"""
+        site = StackAPI('asdfghjkl')
+        with patch('stackapi.StackAPI.fetch', side_effect=fake_stackoverflow_exists, autospec=True) as mock_fetch:
+            for _ in range(3):
+                with self.assertRaises(ValueError):
+                    site._ensure_site_resolved()
+            with self.assertRaises(ValueError):
+                StackAPI('asdfghjkl')._ensure_site_resolved()
+        self.assertEqual(mock_fetch.call_count, 1)
+
+    def test_site_resolution_waits_for_other_thread(self):
+        """Testing that a second caller waits for a resolution already in
+        progress on another thread instead of using an unresolved site"""
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_sites(self, *args, **kwargs):
+            started.set()
+            release.wait(5)
+            return fake_stackoverflow_exists(self)
+
+        site = StackAPI('stackoverflow')
+        names = []
+        with patch('stackapi.StackAPI.fetch', slow_sites):
+            first = threading.Thread(target=site._ensure_site_resolved)
+            first.start()
+            self.assertTrue(started.wait(5))
+            second = threading.Thread(target=lambda: names.append(site._ensure_site_resolved() or site._name))
+            second.start()
+            second.join(0.2)
+            self.assertTrue(second.is_alive())
+            release.set()
+            first.join(5)
+            second.join(5)
+        self.assertEqual(names, ["Stack Overflow"])
+
     def test_nonsite_parameter(self):
         """Testing that it can retrieve data on end points that don't want
         the `site` parameter. Tested using Jeff Atwood's user id"""
-        with patch('stackapi.StackAPI.fetch', fake_stackoverflow_exists) as mock_site:
-            site = StackAPI('stackoverflow')
+        site = fake_site()
         site._api_key = None
         with patch('stackapi.StackAPI.fetch', fake_users) as mock_users:
             self.assertGreaterEqual(len(site.fetch('/users/1/associated')['items']), 1)
 
+    @unittest.skipIf(sys.version_info < (3, 7), "fetch_async requires Python 3.7+ to test")
+    def test_fetch_async_requests_all_pages(self):
+        """Testing that fetch_async requests every remaining page once
+        `total` is known and merges them in page order"""
+        try:
+            import asyncio
+            from stackapi import _async
+        except ImportError:
+            self.skipTest('aiohttp is not installed')
+
+        def fake_page(api, session, semaphore, url, params):
+            if params['filter'] == 'total':
+                return None, {'total': 4}
+            return None, {'items': [params['page']], 'has_more': params['page'] < 4,
+                          'quota_max': 300, 'quota_remaining': 300 - params['page']}
+
+        site = fake_site(max_pages=10, page_size=1)
+        with patch.object(_async, '_get_page', mock.AsyncMock(side_effect=fake_page)) as mock_page:
+            result = asyncio.run(site.fetch_async('questions'))
+        filters = [call[0][4]['filter'] for call in mock_page.call_args_list]
+        self.assertEqual(sorted(filters), ['default'] * 4 + ['total'])
+        self.assertEqual(result['items'], [1, 2, 3, 4])
+        self.assertEqual(result['page'], 4)
+        self.assertFalse(result['has_more'])
+
+    @unittest.skipIf(sys.version_info < (3, 8), "fetch_async requires Python 3.8+ to test")
+    def test_fetch_async_aiohttp(self):
+        """Testing that fetch_async sends the same parameters as fetch through
+        aiohttp, retries 5xx responses, decodes the pages and reports the URL
+        of the page that failed"""
+        try:
+            import asyncio
+            from http.server import BaseHTTPRequestHandler
+            from urllib.parse import parse_qs, urlparse
+            from stackapi import _async
+        except ImportError:
+            self.skipTest('aiohttp is not installed')
+        paths = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                paths.append(self.path)
+                query = parse_qs(urlparse(self.path).query)
+                page = int(query['page'][0])
+                if page == 2:
+                    time.sleep(0.2)  # Finishes after the pages that follow it
+                if query['filter'] == ['total']:
+                    # The first count is retried
+                    status, payload = (200, {'total': 4}) if len(paths) > 2 else (503, {})
+                elif page == 3 and query.get('tagged') == ['fail']:
+                    status, payload = 400, {'error_id': 400, 'error_name': 'bad_parameter',
+                                            'error_message': 'failure'}
+                else:
+                    status, payload = 200, {'items': [page], 'has_more': page < 4, 'quota_max': 300}
+                body = b'\xef\xbb\xbf' + json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        site = fake_site(max_pages=4, page_size=1)
+        site._base_url = serve(self, Handler)
+        with patch.object(_async.asyncio, 'sleep', mock.AsyncMock()):
+            result = asyncio.run(site.fetch_async('questions', accepted=True))
+            self.assertEqual(len(paths), 6)
+            self.assertTrue(all('accepted=True' in path for path in paths))
+            self.assertEqual(result['items'], [1, 2, 3, 4])
+            self.assertEqual(result['quota_max'], 300)
+            self.assertIn('page=4', site.previous_call)
+
+            with self.assertRaises(StackAPIError) as cm:
+                asyncio.run(site.fetch_async('questions', tagged='fail'))
+        self.assertIn('page=3', cm.exception.url)
+
+    @patch('stackapi.stackapi.sleep')
+    def test_transient_errors_retried(self, mock_sleep):
+        """Testing that a throttle violation is retried and the `backoff` of
+        the last page does not block the call that returned it"""
+        site = fake_site()
+        retries = site._session.get_adapter(site._base_url).max_retries
+        self.assertEqual(set(retries.status_forcelist), {429, 500, 502, 503, 504})
+        self.assertTrue(retries.respect_retry_after_header)
+
+        throttled = {'error_id': 502, 'error_name': 'throttle_violation', 'error_message': 'too many requests'}
+        page = {'items': [1], 'has_more': False, 'backoff': 10, 'quota_max': 300, 'quota_remaining': 299}
+        with patch.object(site._session, 'request',
+                          side_effect=[fake_response(throttled, 400), fake_response(page)]) as mock_request:
+            result = site.fetch('questions')
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertEqual(result['items'], [1])
+        self.assertEqual(result['backoff'], 10)
+        mock_sleep.assert_called_once_with(0.5)
+        self.assertGreater(site._backoff_remaining(), 0)
+
+    def test_key_of_list_field(self):
+        """Testing that a key naming a list field returns the quotas of the
+        whole response instead of failing"""
+        site = fake_site()
+        page = {'items': [1], 'has_more': False, 'quota_max': 300, 'quota_remaining': 299}
+        with patch.object(site._session, 'request', return_value=fake_response(page)):
+            result = site.fetch('questions', key='items')
+        self.assertEqual(result['items'], [])
+        self.assertEqual(result['quota_max'], 300)
+        self.assertEqual(result['quota_remaining'], 299)
+
+    def test_previous_call_not_built_on_success(self):
+        """Testing that the URL of a successful call is only built when read"""
+        site = fake_site()
+        page = {'items': [1], 'has_more': False}
+        with patch.object(site._session, 'request', return_value=fake_response(page)):
+            with patch.object(StackAPI, 'previous_call', new_callable=mock.PropertyMock) as mock_previous_call:
+                site.fetch('questions')
+        mock_previous_call.assert_not_called()
+
+    def test_ids_split_into_groups_of_100(self):
+        """Testing that more than 100 ids are sent over several calls"""
+        site = fake_site()
+        page = {'items': [1], 'has_more': False, 'quota_max': 300, 'quota_remaining': 299}
+        with patch.object(site._session, 'request', side_effect=lambda *a, **kw: fake_response(page)) as mock_request:
+            result = site.fetch('badges/{ids}', ids=range(250))
+        urls = [call[0][1] for call in mock_request.call_args_list]
+        self.assertEqual(urls, [
+            'https://api.stackexchange.com/2.2/badges/{}/'.format(';'.join(str(x) for x in range(0, 100))),
+            'https://api.stackexchange.com/2.2/badges/{}/'.format(';'.join(str(x) for x in range(100, 200))),
+            'https://api.stackexchange.com/2.2/badges/{}/'.format(';'.join(str(x) for x in range(200, 250))),
+        ])
+        self.assertEqual(result['items'], [1, 1, 1])
+
+    def test_stream_json(self):
+        """Testing that responses are decoded from the raw stream with stream_json"""
+        try:
+            import ijson
+        except ImportError:
+            self.skipTest('ijson is not installed')
+        site = fake_site(stream_json=True)
+        body = b'{"items": [{"score": 1.5}], "has_more": false, "quota_max": 300}'
+        for prefix in (b'', b'\xef\xbb\xbf'):
+            response = fake_response({})
+            response.raw = io.BytesIO(prefix + body)
+            with patch.object(site._session, 'request', return_value=response) as mock_request:
+                result = site.fetch('questions')
+            self.assertTrue(mock_request.call_args[1]['stream'])
+            self.assertEqual(result['items'], [{'score': 1.5}])
+            self.assertEqual(result['quota_max'], 300)
+
+    @patch('stackapi.stackapi.sleep')
+    def test_http2_client(self, mock_sleep):
+        """Testing that requests go through httpx with http2 and that 5xx
+        responses are retried"""
+        try:
+            import httpx
+        except ImportError:
+            self.skipTest('httpx is not installed')
+        site = fake_site(http2=True)
+        statuses = [503, 200]
+
+        def handler(request):
+            return httpx.Response(statuses.pop(0), json={'items': [1], 'has_more': False})
+
+        site._client = httpx.Client(transport=httpx.MockTransport(handler))
+        result = site.fetch('questions')
+        self.assertEqual(result['items'], [1])
+        self.assertEqual(statuses, [])
+        self.assertTrue(site.previous_call.startswith('https://api.stackexchange.com/2.2/questions/?'))
+
+    def test_close(self):
+        """Testing that the session and the HTTP/2 client are closed on exit"""
+        try:
+            import httpx
+        except ImportError:
+            self.skipTest('httpx is not installed')
+        site = StackAPI('stackoverflow', http2=True)
+        with patch.object(site._session, 'close') as session_close:
+            with site:
+                pass
+        self.assertTrue(site._client.is_closed)
+        session_close.assert_called_once_with()
+
+    def test_pagination_stops_at_max_pages(self):
+        """Testing that pages are requested until has_more is false or
+        max_pages is reached"""
+        site = fake_site(max_pages=3)
+        for pages, expected_calls in ((5, 3), (2, 2)):
+            def request(method, url, params=None, **kwargs):
+                return fake_response({'items': [params['page']], 'has_more': params['page'] < pages, 'total': pages})
+
+            with patch.object(site._session, 'request', side_effect=request) as mock_request:
+                result = site.fetch('questions', page=1)
+            self.assertEqual(mock_request.call_count, expected_calls)
+            self.assertEqual(result['items'], list(range(1, expected_calls + 1)))
+            self.assertEqual(result['page'], expected_calls)
+            self.assertEqual(result['has_more'], pages > 3)
+            self.assertEqual(result['total'], pages)
+
+    def test_results_cached(self):
+        """Testing that repeated calls are answered from the result cache
+        when cache_ttl is set"""
+        page = {'items': [{'score': 1}], 'has_more': False, 'quota_max': 300, 'quota_remaining': 299}
+        for cache_ttl, expected_calls in ((None, 3), (300, 1)):
+            site = fake_site(cache_ttl=cache_ttl)
+            with patch.object(site._session, 'request', side_effect=lambda *a, **kw: fake_response(page)) as mock_request:
+                first = site.fetch('questions', tagged='python')
+                first['items'].append(2)
+                second = site.fetch('questions', tagged='python')
+                second['items'][0]['score'] = 2
+                third = site.fetch('questions', tagged='python')
+            self.assertEqual(mock_request.call_count, expected_calls)
+            self.assertEqual(second['items'], [{'score': 2}])
+            self.assertEqual(third['items'], [{'score': 1}])
+
+    def test_truncated_id_group_sets_has_more(self):
+        """Testing that has_more is set when a group of ids other than the last
+        stops at max_pages"""
+        site = fake_site(max_pages=1)
+
+        def request(method, url, params=None, **kwargs):
+            first_group = url.startswith('https://api.stackexchange.com/2.2/badges/0;')
+            return fake_response({'items': [1], 'has_more': first_group})
+
+        with patch.object(site._session, 'request', side_effect=request) as mock_request:
+            result = site.fetch('badges', ids=range(150))
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertTrue(result['has_more'])
+
+        if sys.version_info >= (3, 7):
+            try:
+                import asyncio
+                from stackapi import _async
+            except ImportError:
+                return
+            def get_page(api, client, semaphore, url, params):
+                return None, request('GET', url, params).json()
+
+            with patch.object(_async, '_get_page', mock.AsyncMock(side_effect=get_page)):
+                result = asyncio.run(site.fetch_async('badges', ids=range(150)))
+            self.assertTrue(result['has_more'])
+
+    def test_truncated_result_not_cached(self):
+        """Testing that a result truncated in a group of ids other than the
+        last isn't kept in the result cache"""
+        site = fake_site(max_pages=1, cache_ttl=300)
+
+        def request(method, url, params=None, **kwargs):
+            first_group = url.startswith('https://api.stackexchange.com/2.2/badges/0;')
+            return fake_response({'items': [1], 'has_more': first_group})
+
+        with patch.object(site._session, 'request', side_effect=request) as mock_request:
+            site.fetch('badges', ids=range(150))
+            site.fetch('badges', ids=range(150))
+        self.assertEqual(mock_request.call_count, 4)
+
+    @patch('time.sleep')
+    @patch('stackapi.stackapi.sleep')
+    def test_persistent_5xx_retried_once_per_attempt(self, mock_sleep, mock_time_sleep):
+        """Testing that a request which always fails with a 500 is sent
+        max_retries + 1 times, not retried again for its error_id"""
+        try:
+            from http.server import BaseHTTPRequestHandler
+        except ImportError:
+            from BaseHTTPServer import BaseHTTPRequestHandler
+        hits = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                hits.append(self.path)
+                body = json.dumps({'error_id': 500, 'error_name': 'internal_error',
+                                   'error_message': 'failure'}).encode('utf-8')
+                self.send_response(500)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        site = fake_site(max_retries=2)
+        site._session.mount('http://', site._session.get_adapter(site._base_url))
+        site._base_url = serve(self, Handler)
+        with self.assertRaises(StackAPIError) as cm:
+            site.fetch('questions')
+        self.assertEqual(cm.exception.error, 500)
+        self.assertTrue(cm.exception.url.startswith(site._base_url + 'questions/?'))
+        self.assertEqual(len(hits), 3)
+
     def test_exceptions_thrown(self):
         """Testing that a StackAPIError is properly thrown
 